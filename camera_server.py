@@ -5,25 +5,76 @@ Professional Pi Camera Stream Server
 - Password authentication  
 - Mobile-optimized UI
 - Docker-ready
+- Single-threaded asyncio server (io_uring via uringcore, opt-in with CAM_IO_URING=1)
 """
 
 import io
 import time
 import base64
-from threading import Condition, Thread
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import gzip
+import hmac
+import socket
+import tempfile
+import asyncio
+import logging
+import logging.handlers
+import queue
+from http import HTTPStatus
+from http.client import HTTPException, parse_headers
 from picamera2 import Picamera2
-from picamera2.encoders import JpegEncoder
+from picamera2.encoders import JpegEncoder, Quality, _hw_encoder_available
+# Import the V4L2 class directly: on non-VC4 Pis picamera2.encoders.MJPEGEncoder
+# is an alias for the libav (CPU) encoder
+from picamera2.encoders.mjpeg_encoder import MJPEGEncoder
 from picamera2.outputs import FileOutput
 from libcamera import Transform
 import os
 import sys
 
+try:
+    import uringcore
+except ImportError:
+    uringcore = None
+
+# Logging - handlers only enqueue; a listener thread does the actual I/O so a
+# slow tty or journald pipe can never stall the event loop
+log_queue = queue.SimpleQueue()
+log = logging.getLogger('picam')
+log.setLevel(logging.INFO)
+log.propagate = False
+log.addHandler(logging.handlers.QueueHandler(log_queue))
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+
 # Configuration - REQUIRED environment variables
 USERNAME = os.getenv('CAM_USER')
 PASSWORD = os.getenv('CAM_PASS')
 PORT = int(os.getenv('CAM_PORT', '8080'))
 
+# Event loop - io_uring needs the uringcore package, which the image does not ship
+IO_URING = os.getenv('CAM_IO_URING', '0') == '1'
+
+# Capture - defaults keep 720p MJPEG within typical Wi-Fi bandwidth
+WIDTH = int(os.getenv('CAM_W', '1280'))
+HEIGHT = int(os.getenv('CAM_H', '720'))
+FPS = int(os.getenv('CAM_FPS', '20'))
+
+# Encoding - 'gpu' uses the hardware MJPEG encoder, 'cpu' uses software JPEG.
+# CAM_QUALITY (0-100) is the JPEG q for cpu and picks a bitrate preset for gpu,
+# unless CAM_BITRATE is set
+ENCODER = os.getenv('CAM_ENCODER', 'gpu').lower()
+QUALITY = int(os.getenv('CAM_QUALITY', '75'))
+BITRATE = int(os.getenv('CAM_BITRATE', '0')) or None
+HW_ENCODER_DEVICE = '/dev/video11'
+
+# Latency - fewer capture buffers and a send buffer of about one JPEG keep
+# frames from queueing; raise CAM_BUFFERS (e.g. 6) if frames get dropped
+BUFFER_COUNT = int(os.getenv('CAM_BUFFERS', '2'))
+STREAM_SNDBUF = 256 * 1024
+
+FRAME_INTERVAL = 1 / FPS
+
 # Validate required environment variables
 if not USERNAME or not PASSWORD:
     print("❌ Error: CAM_USER and CAM_PASS environment variables are required!")
@@ -32,50 +83,11 @@ if not USERNAME or not PASSWORD:
     print("   CAM_PASS=your_secure_password")
     sys.exit(1)
 
-class StreamingOutput(io.BufferedIOBase):
-    def __init__(self):
-        self.frame = None
-        self.condition = Condition()
-
-    def write(self, buf):
-        with self.condition:
-            self.frame = buf
-            self.condition.notify_all()
-
-class AuthHandler(BaseHTTPRequestHandler):
-    def check_auth(self):
-        auth_header = self.headers.get('Authorization')
-        if not auth_header:
-            return False
-        
-        try:
-            auth_type, credentials = auth_header.split(' ', 1)
-            if auth_type.lower() != 'basic':
-                return False
-            
-            decoded = base64.b64decode(credentials).decode('utf-8')
-            username, password = decoded.split(':', 1)
-            return username == USERNAME and password == PASSWORD
-        except:
-            return False
+# The only Basic credentials we accept, so requests need no decoding
+EXPECTED_CREDENTIALS = base64.b64encode(f'{USERNAME}:{PASSWORD}'.encode())
 
-    def send_auth_request(self):
-        self.send_response(401)
-        self.send_header('WWW-Authenticate', 'Basic realm="Pi Camera"')
-        self.send_header('Content-Type', 'text/html')
-        self.end_headers()
-        self.wfile.write(b'<h1>401 - Authentication Required</h1>')
-
-    def do_GET(self):
-        if not self.check_auth():
-            self.send_auth_request()
-            return
-
-        if self.path == '/' or self.path == '/index.html':
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/html')
-            self.end_headers()
-            html = '''<!DOCTYPE html>
+# Index page is static, so encode it once instead of on every request
+INDEX_HTML = '''<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -208,7 +220,7 @@ class AuthHandler(BaseHTTPRequestHandler):
         }
 
         function toggleInfo() {
-            alert('Pi Camera Module 3\\nResolution: 1920x1080\\nStatus: Connected');
+            alert('Pi Camera Module 3\\nResolution: {resolution}\\nStatus: Connected');
         }
 
         // Auto-refresh if stream fails
@@ -231,60 +243,291 @@ class AuthHandler(BaseHTTPRequestHandler):
         }, false);
     </script>
 </body>
-</html>'''
-            self.wfile.write(html.encode())
+</html>'''.replace('{resolution}', f'{WIDTH}x{HEIGHT}').encode()
+INDEX_CONTENT_LENGTH = str(len(INDEX_HTML))
+INDEX_HTML_GZ = gzip.compress(INDEX_HTML, 9)
+INDEX_HTML_GZ_LEN = str(len(INDEX_HTML_GZ))
 
-        elif self.path == '/stream.mjpg':
+def make_static_file(body):
+    # Anonymous file holding a static body, so it can be sent with sendfile(2)
+    file = tempfile.TemporaryFile()
+    file.write(body)
+    file.flush()
+    return file
+
+INDEX_FILE = make_static_file(INDEX_HTML)
+INDEX_FILE_GZ = make_static_file(INDEX_HTML_GZ)
+
+# /stream.mjpg response head; the page reconnects often, so never rebuild it
+STREAM_HEADERS = (
+    b'HTTP/1.0 200 OK\r\n'
+    b'Content-Type: multipart/x-mixed-replace; boundary=FRAME\r\n'
+    b'Cache-Control: no-cache, no-store, must-revalidate\r\n'
+    b'Pragma: no-cache\r\n'
+    b'Expires: 0\r\n'
+    b'\r\n'
+)
+
+# Per-part multipart header, filled with the JPEG size via C-level %d
+FRAME_PREAMBLE = b'--FRAME\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+
+class StreamingOutput(io.BufferedIOBase):
+    def __init__(self, loop):
+        self.loop = loop
+        # One single-slot queue per connected /stream.mjpg client
+        self.clients = set()
+
+    def write(self, buf):
+        # Called from the encoder thread. Each JPEG is framed and joined exactly
+        # once here, so every client sends the same ready-made payload with a
+        # single write (Python 3.11's writelines() would join it per client).
+        frame = memoryview(buf)
+        payload = FRAME_PREAMBLE % frame.nbytes + frame + b'\r\n'
+        self.loop.call_soon_threadsafe(self._fan_out, payload)
+        return len(buf)
+
+    def writable(self):
+        return True
+
+    def _fan_out(self, payload):
+        # Drop-oldest: a client that hasn't taken its last frame gets this
+        # one instead, so nobody ever falls more than one frame behind
+        for slot in self.clients:
+            if slot.full():
+                slot.get_nowait()
+            slot.put_nowait(payload)
+
+class AuthHandler:
+    """One instance per client connection, mirroring BaseHTTPRequestHandler."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.client_address = writer.get_extra_info('peername')
+        self._headers_buffer = []
+        self.setup()
+
+    def setup(self):
+        self._auth_ok = False
+        # Each MJPEG part is handed to the transport as a single buffer, so
+        # Nagle only adds delay; push frames out as soon as they are written.
+        self.connection = self.writer.get_extra_info('socket')
+        if self.connection is not None:
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    @classmethod
+    async def handle(cls, reader, writer):
+        handler = cls(reader, writer)
+        try:
+            if await handler.parse_request():
+                if handler.command == 'GET':
+                    await handler.do_GET()
+                else:
+                    handler.send_error(501)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def parse_request(self):
+        try:
+            head = await self.reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            self.send_error(431)
+            return False
+
+        request_line, _, header_block = head.partition(b'\r\n')
+        words = request_line.decode('iso-8859-1').split()
+        if len(words) != 3:
+            self.send_error(400)
+            return False
+
+        self.command, self.path, self.request_version = words
+        try:
+            self.headers = parse_headers(io.BytesIO(header_block))
+        except HTTPException:
+            # Too many headers or an over-long header line
+            self.send_error(431)
+            return False
+        return True
+
+    def send_response(self, code):
+        self._headers_buffer = [b'HTTP/1.0 %d %s\r\n' % (code, HTTPStatus(code).phrase.encode())]
+
+    def send_header(self, keyword, value):
+        self._headers_buffer.append(f'{keyword}: {value}\r\n'.encode('latin-1'))
+
+    def end_headers(self):
+        self._headers_buffer.append(b'\r\n')
+        self.writer.write(b''.join(self._headers_buffer))
+        self._headers_buffer = []
+
+    def send_error(self, code):
+        body = b'<h1>%d - %s</h1>' % (code, HTTPStatus(code).phrase.encode())
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        self.writer.write(body)
+
+    async def send_file(self, file, body):
+        # Zero-copy from the file when the loop supports it; the loop's own
+        # fallback seeks a shared file object, so write the cached bytes instead
+        transport = self.writer.transport
+        if transport.is_closing():
+            return
+        try:
+            await asyncio.get_running_loop().sendfile(transport, file, 0, len(body), fallback=False)
+        except RuntimeError:
+            # With a closing transport ruled out, this is only "native sendfile
+            # not supported": RuntimeError for transports without it, or its
+            # SendfileNotAvailableError subclass when the native attempt fails
+            self.writer.write(body)
+
+    def accepts_gzip(self):
+        # An explicit gzip entry wins over '*'; q=0 means "not acceptable"
+        qualities = {}
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = coding.partition(';')
+            q = 1.0
+            for param in params.split(';'):
+                key, _, value = param.partition('=')
+                if key.strip().lower() == 'q':
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            qualities[name.strip().lower()] = q
+        return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+    def check_auth(self):
+        # Only success is remembered, so a client answering a 401 on the same
+        # connection still gets its new credentials checked
+        if self._auth_ok:
+            return True
+
+        auth_header = self.headers.get('Authorization', '').encode('latin-1')
+        # The scheme is case-insensitive, the credentials token is not
+        auth_type, _, credentials = auth_header.partition(b' ')
+        self._auth_ok = (auth_type.lower() == b'basic'
+                         and hmac.compare_digest(credentials.strip(), EXPECTED_CREDENTIALS))
+        return self._auth_ok
+
+    def send_auth_request(self):
+        self.send_response(401)
+        self.send_header('WWW-Authenticate', 'Basic realm="Pi Camera"')
+        self.send_header('Content-Type', 'text/html')
+        self.end_headers()
+        self.writer.write(b'<h1>401 - Authentication Required</h1>')
+
+    async def do_GET(self):
+        if not self.check_auth():
+            self.send_auth_request()
+            return
+
+        if self.path == '/' or self.path == '/index.html':
+            gzip_ok = self.accepts_gzip()
             self.send_response(200)
-            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=FRAME')
-            self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
-            self.send_header('Pragma', 'no-cache')
-            self.send_header('Expires', '0')
+            self.send_header('Content-Type', 'text/html')
+            if gzip_ok:
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', INDEX_HTML_GZ_LEN)
+                file, body = INDEX_FILE_GZ, INDEX_HTML_GZ
+            else:
+                self.send_header('Content-Length', INDEX_CONTENT_LENGTH)
+                file, body = INDEX_FILE, INDEX_HTML
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Connection', 'close')
             self.end_headers()
-            
+            await self.send_file(file, body)
+
+        elif self.path == '/stream.mjpg':
+            self.writer.write(STREAM_HEADERS)
+
+            # Clients that cannot keep up get frames dropped instead of queued,
+            # so latency stays bounded to roughly one frame. Shrinking the
+            # kernel send buffer keeps it from hiding several stale JPEGs.
+            if self.connection is not None:
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, STREAM_SNDBUF)
+            slot = asyncio.Queue(maxsize=1)
+            output.clients.add(slot)
             try:
                 while True:
-                    with output.condition:
-                        output.condition.wait()
-                        frame = output.frame
-                    
-                    self.wfile.write(b'--FRAME\r\n')
-                    self.send_header('Content-Type', 'image/jpeg')
-                    self.send_header('Content-Length', str(len(frame)))
-                    self.end_headers()
-                    self.wfile.write(frame)
-                    self.wfile.write(b'\r\n')
-            except Exception as e:
-                print(f'Client disconnected: {self.client_address}')
+                    payload = await slot.get()
+                    if self.writer.transport.get_write_buffer_size():
+                        # Previous frame still queued for this client
+                        continue
+
+                    self.writer.write(payload)
+                    try:
+                        await asyncio.wait_for(self.writer.drain(), FRAME_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+            except ConnectionError:
+                log.info('Client disconnected: %s', self.client_address)
+            finally:
+                output.clients.discard(slot)
 
         else:
             self.send_error(404)
 
-class StreamingServer(HTTPServer):
-    allow_reuse_address = True
-    daemon_threads = True
+def create_encoder():
+    # The V4L2 encoder only opens its device in start_recording(), so check for
+    # it up front: the Pi 5 has no JPEG block, and containers may lack the node
+    if ENCODER == 'gpu':
+        if _hw_encoder_available and os.path.exists(HW_ENCODER_DEVICE):
+            return MJPEGEncoder(bitrate=BITRATE)
+        log.warning('⚠ Hardware MJPEG encoder unavailable (needs a VC4 Pi and %s), using CPU',
+                    HW_ENCODER_DEVICE)
+    return JpegEncoder(q=QUALITY)
+
+def recording_quality(encoder):
+    # Any quality passed to start_recording() overwrites the encoder's own q or
+    # bitrate, so only use it to map CAM_QUALITY onto a bitrate preset for the
+    # hardware encoder when CAM_BITRATE was not given
+    if not isinstance(encoder, MJPEGEncoder) or BITRATE is not None:
+        return None
+    levels = (Quality.VERY_LOW, Quality.LOW, Quality.MEDIUM, Quality.HIGH, Quality.VERY_HIGH)
+    return levels[min(max(QUALITY, 0) * len(levels) // 101, len(levels) - 1)]
 
 if __name__ == '__main__':
+    log_listener.start()
+    if IO_URING:
+        if uringcore is not None:
+            asyncio.set_event_loop_policy(uringcore.EventLoopPolicy())
+        else:
+            log.warning('⚠ CAM_IO_URING=1 but uringcore is not installed, using the default loop')
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
     # Initialize camera with 180° rotation
     picam2 = Picamera2()
     config = picam2.create_video_configuration(
-        main={'size': (1920, 1080)},
+        main={'size': (WIDTH, HEIGHT)},
+        buffer_count=BUFFER_COUNT,
+        controls={'FrameDurationLimits': (int(1e6 / FPS),) * 2},
         transform=Transform(hflip=True, vflip=True)
     )
     picam2.configure(config)
     
-    output = StreamingOutput()
-    picam2.start_recording(JpegEncoder(), FileOutput(output))
+    output = StreamingOutput(loop)
+    encoder = create_encoder()
+    picam2.start_recording(encoder, FileOutput(output), quality=recording_quality(encoder))
     
     try:
-        server = StreamingServer(('0.0.0.0', PORT), AuthHandler)
+        server = loop.run_until_complete(
+            asyncio.start_server(AuthHandler.handle, '0.0.0.0', PORT, reuse_address=True)
+        )
         print(f'🚀 Pi Camera Server starting on port {PORT}')
         print(f'🔐 Username: {USERNAME} | Password: {PASSWORD}')
         print(f'🌐 Access: http://your-pi-ip:{PORT}')
         print('📱 Mobile optimized | 🔄 Auto-reconnect | 🔒 Password protected')
-        server.serve_forever()
+        loop.run_until_complete(server.serve_forever())
     except KeyboardInterrupt:
         print('\n🛑 Shutting down camera server...')
     finally:
         picam2.stop_recording()
         picam2.stop()
+        loop.close()
+        log_listener.stop()
@@ -15,7 +15,7 @@ echo "✅ Camera detected!"
 # Load environment variables from .env if it exists
 if [ -f .env ]; then
     echo "📝 Loading configuration from .env file..."
-    export $(cat .env | xargs)
+    export $(grep -v '^#' .env | xargs)
 fi
 
 # Get user preferences (with defaults from .env or fallback)